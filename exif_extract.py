@@ -13,7 +13,8 @@ Author: Richard Thomas
 Public Repository: https://github.com/richard-thomas/py-exif-extract
 
 Command line usage:
-  python exif_extract.py [-h] [-p] [-a] [-s] [-o OUTPUT] infile [infile ...]
+  python exif_extract.py [-h] [-p] [-a] [-s] [-o OUTPUT] [-w WORKERS]
+                         infile [infile ...]
 
 positional arguments:
   infile                input JPEG image filename(s)
@@ -25,6 +26,9 @@ optional arguments:
   -s, --silent          do not write progress to stderr
   -o OUTPUT, --output OUTPUT
                         filename to write CSV metadata output
+  -w WORKERS, --workers WORKERS
+                        number of worker processes used to read files
+                        (default = 1)
 
 Example command line usage:
   python exif_extract.py -o exif_output.csv example_images/*
@@ -47,8 +51,340 @@ MIT Licence (https://choosealicense.com/licenses/mit/)
 
 from exif import Image
 import argparse
+import collections.abc
+import concurrent.futures
+import csv
+import functools
 import glob
+import io
+import itertools
+import mmap
+import os
+import queue
+import stat
 import sys
+import threading
+
+# JPEG marker bytes (following the 0xFF prefix) used to locate EXIF metadata
+_JPEG_SOI = b'\xff\xd8'
+_JPEG_APP1 = 0xE1
+_JPEG_SOS = 0xDA
+
+# Initial read size (bytes) when looking for the EXIF segment in a JPEG file
+# which cannot be memory-mapped
+_HEADER_READ_SIZE = 131072
+
+# Number of CSV rows formatted in memory per write to the output file
+_CSV_BLOCK_ROWS = 4096
+
+def _exif_header_end(image_map):
+    """
+    Find the end of the EXIF (APP1) segment at the start of a JPEG image.
+
+    The end is taken as the marker following the APP1 segment, found in the
+    same way as by the "exif" library (so tolerating segment lengths which
+    stop early). Shared by memory-mapped and streamed reads so both give the
+    same header bytes.
+
+    Args:
+        image_map: memory-mapped file (or bytes) holding the start of a JPEG
+            image
+    Returns:
+        length of the file header to pass to exif.Image() (may exceed the
+        length of image_map by 1 byte), or None if the end of the header
+        cannot be found within image_map
+    """
+
+    if image_map[:2] != _JPEG_SOI:
+        return None
+
+    cursor = 2
+    while cursor + 4 <= len(image_map):
+        if image_map[cursor] != 0xFF:
+            break
+        marker = image_map[cursor + 1]
+        if marker == 0xFF:
+            # Fill byte before marker
+            cursor += 1
+            continue
+        if marker == _JPEG_SOS:
+            # Start of compressed image data reached: no EXIF segment
+            return cursor
+
+        # Segment length excludes the 2 marker bytes
+        segment_end = cursor + 2 + int.from_bytes(
+            image_map[cursor + 2:cursor + 4], 'big')
+        if marker == _JPEG_APP1:
+            # If the expected length stops early the "exif" library keeps
+            # traversing until another section is found, so include up to
+            # (and including) the following marker
+            next_marker = image_map.find(b'\xff', segment_end)
+            if next_marker < 0:
+                return None
+            return next_marker + 2
+        cursor = segment_end
+
+    return None
+
+def _read_exif_header(image_map):
+    """
+    Copy the start of a JPEG file up to the end of its EXIF (APP1) segment.
+
+    Only the JPEG segment markers preceding the APP1 segment are examined, so
+    for a memory-mapped file just the pages holding the file header are read
+    from disk. If the JPEG segment structure cannot be followed then the whole
+    file is returned so the "exif" library can make its own attempt.
+
+    Args:
+        image_map: memory-mapped file (or bytes) holding a JPEG image
+    Returns:
+        bytes suitable for passing to exif.Image()
+    """
+
+    header_end = _exif_header_end(image_map)
+    if header_end is None:
+        return image_map[:]
+    return image_map[:header_end]
+
+def _stream_exif_header(file, image_bytes=b''):
+    """
+    Read the start of a JPEG file up to the end of its EXIF (APP1) segment,
+    for files which cannot be memory-mapped (e.g. pipes).
+
+    The file is read in blocks of _HEADER_READ_SIZE bytes until the marker
+    following the APP1 segment (or the start of image data) is found, so the
+    result matches _read_exif_header() for the same file. If the JPEG
+    segment structure cannot be followed then the whole file is returned.
+
+    Args:
+        file: binary file object
+    Args (optional):
+        image_bytes: bytes already read from the start of the file
+    Returns:
+        bytes suitable for passing to exif.Image()
+    """
+
+    while True:
+        block = file.read(_HEADER_READ_SIZE)
+        image_bytes += block
+        header_end = _exif_header_end(image_bytes)
+        if header_end is not None:
+            break
+        if not block:
+            return image_bytes
+
+    if header_end > len(image_bytes):
+        image_bytes += file.read(header_end - len(image_bytes))
+    return image_bytes[:header_end]
+
+@functools.lru_cache(maxsize=None)
+def _prettify(key):
+    """Convert an EXIF field heading to a more human readable form."""
+
+    return (key.replace('_', ' ').title()
+        .replace("Gps", "GPS").replace("Jpeg", "JPEG")
+        .replace("Exif", "EXIF")).replace("Id", "ID")
+
+def _read_one(path_name, full_exif=False):
+    """
+    Read the EXIF segment (or whole file) of a single JPEG image file.
+
+    Args:
+        path_name: input JPEG image filename
+    Args (optional):
+        full_exif: (bool) Read the whole file rather than stopping after its
+            EXIF segment
+    Returns:
+        bytes to be parsed by _parse_one(), or None if not a JPEG file
+    Raises:
+        ExifExtract.ExtractError: reading file failed
+    """
+
+    with open(path_name, 'rb') as file:
+        try:
+            # Skip anything not starting with a JPEG Start Of Image marker
+            # (including empty files) without invoking the "exif" library
+            image_bytes = file.read(2)
+            if image_bytes != _JPEG_SOI:
+                return None
+
+            if full_exif:
+                return image_bytes + file.read()
+
+            # Files which cannot be memory-mapped (pipes, some special or
+            # network files) are read as a stream instead
+            if stat.S_ISREG(os.fstat(file.fileno()).st_mode):
+                try:
+                    with mmap.mmap(file.fileno(), 0,
+                            access=mmap.ACCESS_READ) as image_map:
+                        return _read_exif_header(image_map)
+                except (ValueError, OSError):
+                    pass
+            return _stream_exif_header(file, image_bytes)
+        except Exception:
+            raise ExifExtract.ExtractError(path_name)
+
+def _parse_one(path_name, image_bytes):
+    """
+    Parse EXIF metadata from bytes read from a single JPEG image file.
+
+    Args:
+        path_name: input JPEG image filename
+        image_bytes: bytes returned by _read_one()
+    Returns:
+        (image_exif_data, skip_reason): dictionary of EXIF data for the
+        image and None, or None and a message giving the reason the file was
+        skipped
+    Raises:
+        ExifExtract.ExtractError: EXIF metadata extraction failed
+    """
+
+    if image_bytes is None:
+        return None, "Not a JPEG image file"
+
+    try:
+        my_image = Image(image_bytes)
+    except Exception:
+        raise ExifExtract.ExtractError(path_name)
+
+    if not my_image.has_exif:
+        return None, "No EXIF metadata found"
+
+    # Extract just EXIF data (dir() would also list the Image methods)
+    image_exif_data = {'filename': path_name}
+    for key in my_image.list_all():
+        image_exif_data[key] = my_image.get(key)
+
+    return image_exif_data, None
+
+def _extract_one(path_name, full_exif=False):
+    """
+    Read and parse EXIF metadata from a single JPEG image file.
+
+    Defined at module level so that it can be run in worker processes.
+    Arguments and return value are as for _read_one() and _parse_one().
+    """
+
+    return _parse_one(path_name, _read_one(path_name, full_exif))
+
+def _read_ahead(infilenames, full_exif=False):
+    """
+    Generate (path_name, image_bytes) for each file in turn, with files read
+    by a background thread up to 2 files ahead of the caller, so that disk
+    reads overlap with parsing of the previous file.
+
+    Args:
+        infilenames: list of input JPEG image filenames
+    Args (optional):
+        full_exif: (bool) Read the whole of each file rather than stopping
+            after its EXIF segment
+    Raises:
+        ExifExtract.ExtractError: reading file failed
+    """
+
+    file_queue = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def reader():
+        for path_name in infilenames:
+            if stop.is_set():
+                return
+            try:
+                file_queue.put((path_name, _read_one(path_name, full_exif)))
+            except Exception as error:
+                # Re-raised in the consuming thread
+                file_queue.put((path_name, error))
+                return
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        for _ in infilenames:
+            path_name, image_bytes = file_queue.get()
+            if isinstance(image_bytes, Exception):
+                raise image_bytes
+            yield path_name, image_bytes
+    finally:
+        # Unblock the reader if the caller stopped early, then wait for it
+        stop.set()
+        while not file_queue.empty():
+            file_queue.get_nowait()
+        thread.join()
+
+# Placeholder in exif_table columns for fields missing from an image
+_MISSING = object()
+
+class _RowView(collections.abc.Mapping):
+    """Read-only dictionary view of the EXIF metadata for a single image."""
+
+    def __init__(self, columns, keys, index):
+        self._columns = columns
+        self._keys = keys
+        self._index = index
+
+    def __getitem__(self, key):
+        value = self._columns[key][self._index]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _ExifTable(collections.abc.Sequence):
+    """
+    EXIF metadata for a set of images, stored as a list of values per field
+    (rather than a dictionary per image) to reduce memory usage.
+
+    Indexing or iterating gives a read-only dictionary view of each image's
+    metadata, so it can be used in the same way as a list of dictionaries.
+    """
+
+    def __init__(self, field_headings):
+        # Dictionary keys also give the order fields were first found in
+        # (depends on ordered dictionaries in Python 3.7+)
+        self.columns = {key: [] for key in field_headings}
+
+        # Fields present in each row (in column order), so that iterating a
+        # row view does not need to check every column
+        self._row_keys = []
+
+    def append(self, image_exif_data):
+        """Add a dictionary of EXIF data for an image as a new row."""
+
+        # Add any new EXIF fields found in this image as new columns
+        # (Keep the order where possible - new fields added at the end)
+        n_rows = len(self._row_keys)
+        for key in image_exif_data:
+            if key not in self.columns:
+                self.columns[key] = [_MISSING] * n_rows
+
+        row_keys = []
+        for key, column in self.columns.items():
+            value = image_exif_data.get(key, _MISSING)
+            column.append(value)
+            if value is not _MISSING:
+                row_keys.append(key)
+        self._row_keys.append(tuple(row_keys))
+
+    def __getitem__(self, index):
+        n_rows = len(self._row_keys)
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(n_rows))]
+        if index < 0:
+            index += n_rows
+        if not 0 <= index < n_rows:
+            raise IndexError("exif_table index out of range")
+        return _RowView(self.columns, self._row_keys[index], index)
+
+    def __len__(self):
+        return len(self._row_keys)
 
 class ExifExtract:
     """Reading and processing of EXIF metadata from image files."""
@@ -56,12 +392,16 @@ class ExifExtract:
     class ExtractError(Exception):
         """Exception Type: EXIF metadata extraction failed."""
 
-        def __init__(self):
+        def __init__(self, path_name=None):
+            self.path_name = path_name
             self.message = (
                 "EXIF metadata extraction failed!"
             )
+            if path_name is not None:
+                self.message += " (file: %s)" % path_name
 
-    def __init__(self, infilenames, verbose=False):
+    def __init__(self, infilenames, verbose=False, full_exif=False,
+            workers=1):
         """
         Parse all EXIF metadata from specified JPEG image files.
 
@@ -69,6 +409,13 @@ class ExifExtract:
             infilenames: array of input JPEG image filenames
         Args (optional):
             verbose: (bool) List files to stderr as they are processed
+            full_exif: (bool) Read the whole of each file rather than stopping
+                after its EXIF segment
+            workers: (int) Number of worker processes used to read files
+                (default = 1: read in this process, None = number of CPUs).
+                With more than 1 worker, scripts calling this on Windows or
+                macOS must do so from within an if __name__ == "__main__":
+                guard (see multiprocessing documentation)
         Raises:
             ExtractError: EXIF metadata extraction failed
         """
@@ -81,58 +428,72 @@ class ExifExtract:
                 decimal_degrees = -decimal_degrees
             return decimal_degrees
 
-        self.exif_table = []
-        field_headings = ['filename','gps_lat_decimal','gps_lon_decimal']
-        for path_name in infilenames:
-            if verbose:
-                sys.stderr.write("Reading file: %s\n" % path_name)
-
-            with open(path_name, 'rb') as file:
-                try:
-                    image_bytes = file.read()
-                    my_image = Image(image_bytes)
-                except Exception:
-                    raise ExifExtract.ExtractError
-
-            if not my_image.has_exif:
+        infilenames = list(infilenames)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(infilenames))
+
+        # Read and parse files in parallel worker processes (EXIF parsing is
+        # pure Python so threads would be limited by the GIL). With a single
+        # worker, files are instead read ahead by a background thread while
+        # being parsed in this process. Either way results are returned
+        # lazily, in the same order as infilenames.
+        if workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers)
+            results = executor.map(_extract_one, infilenames,
+                itertools.repeat(full_exif),
+                chunksize=max(1, len(infilenames) // (workers * 4)))
+        else:
+            executor = None
+            prefetched = _read_ahead(infilenames, full_exif)
+            results = itertools.starmap(_parse_one, prefetched)
+
+        self.exif_table = _ExifTable(
+            ['filename','gps_lat_decimal','gps_lon_decimal'])
+        try:
+            for path_name, (image_exif_data, skip_reason) in zip(
+                    infilenames, results):
                 if verbose:
-                    sys.stderr.write("- No EXIF metadata found - skipping file\n")
-                continue
-
-            # Extract just EXIF data
-            image_exif_data = {'filename': path_name}
-            for key in dir(my_image):
-                image_exif_data[key] = my_image.get(key)
-
-            # Calculate consolidated lat/lon decimal fields (including signs)
-            if 'gps_latitude' in image_exif_data:
-                image_exif_data['gps_lat_decimal'] = gps_decimal_coords(
-                    image_exif_data['gps_latitude'],
-                    image_exif_data['gps_latitude_ref'])
-            if 'gps_longitude' in image_exif_data:
-                image_exif_data['gps_lon_decimal'] = gps_decimal_coords(
-                    image_exif_data['gps_longitude'],
-                    image_exif_data['gps_longitude_ref'])
-
-            self.exif_table += [image_exif_data]
-
-            # Add any new EXIF fields found in this file to existing field list
-            # (Keep the order where possible - new fields added at the end)
-            # Method depends on ordered dictionaries in Python 3.7+:
-            # https://stackoverflow.com/questions/12897374/get-unique-values-from-a-list-in-python
-            field_headings = list(dict.fromkeys(field_headings +
-                list(image_exif_data)))
-
-        self.field_headings = field_headings
+                    sys.stderr.write("Reading file: %s\n" % path_name)
+
+                if image_exif_data is None:
+                    if verbose:
+                        sys.stderr.write(
+                            "- %s - skipping file\n" % skip_reason)
+                    continue
+
+                # Calculate consolidated lat/lon decimal fields (including
+                # signs) here rather than in the workers, in a single pass
+                if 'gps_latitude' in image_exif_data:
+                    image_exif_data['gps_lat_decimal'] = gps_decimal_coords(
+                        image_exif_data['gps_latitude'],
+                        image_exif_data['gps_latitude_ref'])
+                if 'gps_longitude' in image_exif_data:
+                    image_exif_data['gps_lon_decimal'] = gps_decimal_coords(
+                        image_exif_data['gps_longitude'],
+                        image_exif_data['gps_longitude_ref'])
+
+                self.exif_table.append(image_exif_data)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            else:
+                prefetched.close()
+
+        self.field_headings = list(self.exif_table.columns)
 
         # Convert field headings to a more human readable form
-        self.pretty_aliases = {}
-        for key in self.field_headings:
-            self.pretty_aliases[key] = (key.replace('_', ' ').title()
-                .replace("Gps", "GPS").replace("Jpeg", "JPEG")
-                .replace("Exif", "EXIF")).replace("Id", "ID")
+        self.pretty_aliases = {key: _prettify(key)
+            for key in self.field_headings}
         self.pretty_aliases['gps_lat_decimal'] = "GPS Latitude  (decimal degrees)"
         self.pretty_aliases['gps_lon_decimal'] = "GPS Longitude (decimal degrees)"
+        self.pretty_aliases_list = [self.pretty_aliases[key]
+            for key in self.field_headings]
+
+        # Copy of the field headings pretty_aliases_list was built from, as
+        # callers may change field_headings after this
+        self._aliased_headings = list(self.field_headings)
 
     def write_csv(self, outfile, use_aliases=False):
         """
@@ -144,29 +505,41 @@ class ExifExtract:
             use_aliases: use prettified aliases for CSV headings
         """
 
+        # Rows are formatted into an in-memory buffer which is written to the
+        # output file in blocks, to reduce the number of write calls.
+        # Output files may not have been opened with newline='' so use a
+        # plain '\n' line terminator (translated by text mode as required)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+
         # Write field name header line to output file
         if use_aliases:
-            aliases = [self.pretty_aliases[key] for key in self.field_headings]
-            outfile.write(','.join(aliases) + '\n')
+            if self.field_headings == self._aliased_headings:
+                writer.writerow(self.pretty_aliases_list)
+            else:
+                writer.writerow(
+                    [self.pretty_aliases[key] for key in self.field_headings])
         else:
-            outfile.write(','.join(self.field_headings) + '\n')
-
-        # Write body lines (1 per input file containing EXIF data).
-        for row in self.exif_table:
-            csv_fields = []
-            for key in self.field_headings:
-                # If field missing for any file, then empty field (just a comma).
-                field = str(row.get(key, ''))
-
-                # Double up any double quotes in the field
-                field = field.replace('"', '""')
-
-                # If field has "," characters then put it all in double quotes
-                if ',' in field:
-                    field = '"' + field + '"'
-                csv_fields += [str(field)]
-
-            outfile.write(','.join(csv_fields) + '\n')
+            writer.writerow(self.field_headings)
+
+        # Write body lines (1 per input file containing EXIF data), formed by
+        # lazily transposing the table columns (one row at a time).
+        # If field missing for any file, then empty field (just a comma).
+        # Fields containing delimiters, quotes or newlines are quoted.
+        columns = self.exif_table.columns
+        n_rows = len(self.exif_table)
+        rows = (['' if value is _MISSING else str(value) for value in row]
+            for row in zip(*[columns[key] if key in columns
+                else itertools.repeat(_MISSING, n_rows)
+                for key in self.field_headings]))
+        while True:
+            block = list(itertools.islice(rows, _CSV_BLOCK_ROWS))
+            writer.writerows(block)
+            outfile.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            if len(block) < _CSV_BLOCK_ROWS:
+                break
 
     def pretty_print_exif(self, single_image_exif, outfile=sys.stdout):
         """
@@ -179,9 +552,10 @@ class ExifExtract:
             outfile: print output file (default = stdout)
         """
 
-        for key in self.field_headings:
-            value = single_image_exif.get(key)
-            if value and key != "filename":
+        # Only the fields present for this image (in field heading order),
+        # ignoring any not among the field headings
+        for key, value in single_image_exif.items():
+            if value and key != "filename" and key in self.pretty_aliases:
                 outfile.write(self.pretty_aliases[key] + ": " + str(value) + "\n")
 
 # ------------------------------------------------------------------------------
@@ -226,6 +600,13 @@ if __name__ == "__main__":
         type=argparse.FileType("w"),
         help="filename to write CSV metadata output",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes used to read files (default = 1)",
+    )
     args = parser.parse_args()
 
     # Perform wildcard expansion on input file names & ensure at least one
@@ -239,7 +620,8 @@ if __name__ == "__main__":
 
     # Extract EXIF data from all files
     try:
-        exif_data = ExifExtract(infile_list, not args.silent)
+        exif_data = ExifExtract(infile_list, not args.silent,
+            workers=args.workers)
     except ExifExtract.ExtractError as error:
         sys.stderr.write("ERROR: %s\n" % error.message)
         sys.exit(1)